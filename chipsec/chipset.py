@@ -901,8 +901,9 @@ class Chipset:
                 threads_to_use = [cores[p][0] for p in cores]
             else: # Default to threads
                 threads_to_use = range(self.helper.get_threads_count())
-            for t in threads_to_use:
-                values.append(self.read_register(reg_name, t))
+            msr_addr = int(reg['msr'], 16)
+            for (eax, edx) in self.msr.read_msr_batch([(t, msr_addr) for t in threads_to_use]):
+                values.append((edx << 32) | eax)
         elif rtype in [RegisterType.MMCFG, RegisterType.PCICFG, RegisterType.MMIO]:
             if bus_data:
                 for bus in bus_data:
@@ -44,6 +44,8 @@ usage:
     >>> read_mmcfg_reg(cs, 0, 0, 0, 0x10, 4, 0xFFFFFFFF)
 """
 
+import struct
+
 from chipsec.hal import hal_base
 from chipsec.exceptions import CSReadError
 
@@ -127,10 +129,14 @@ class MMIO(hal_base.HALBase):
     # Read MMIO registers as offsets off of MMIO range base address
     #
     def read_MMIO(self, bar_base, size):
-        regs = []
         size -= size % 4
-        for offset in range(0, size, 4):
-            regs.append(self.read_MMIO_reg(bar_base, offset))
+        block = self.cs.helper.read_mmio_range(bar_base, size)
+        if block is None:
+            return [self.read_MMIO_reg(bar_base, offset) for offset in range(0, size, 4)]
+        regs = list(struct.unpack('<{:d}I'.format(size // 4), block))
+        if self.logger.HAL:
+            for offset, reg_value in zip(range(0, size, 4), regs):
+                self.logger.log( '[mmio] 0x{:08X} + 0x{:08X} = 0x{:08X}'.format(bar_base, offset, reg_value) )
         return regs
 
     #
@@ -138,9 +144,8 @@ class MMIO(hal_base.HALBase):
     #
     def dump_MMIO(self, bar_base, size ):
         self.logger.log("[mmio] MMIO register range [0x{:016X}:0x{:016X}+{:08X}]:".format(bar_base, bar_base, size))
-        size -= size % 4
-        for offset in range(0, size, 4):
-            self.logger.log( '+{:08X}: {:08X}'.format(offset, self.read_MMIO_reg(bar_base, offset)) )
+        for offset, reg_value in zip(range(0, size, 4), self.read_MMIO(bar_base, size)):
+            self.logger.log( '+{:08X}: {:08X}'.format(offset, reg_value) )
 
 
     ###############################################################################
@@ -87,6 +87,14 @@ class Msr:
         if logger().HAL: logger().log( "[cpu{:d}] RDMSR( 0x{:x} ): EAX = 0x{:08X}, EDX = 0x{:08X}".format(cpu_thread_id, msr_addr, eax, edx) )
         return (eax, edx)
 
+    def read_msr_batch( self, requests ):
+        requests = list(requests)
+        results = self.helper.read_msr_batch( requests )
+        if logger().HAL:
+            for (cpu_thread_id, msr_addr), (eax, edx) in zip(requests, results):
+                logger().log( "[cpu{:d}] RDMSR( 0x{:x} ): EAX = 0x{:08X}, EDX = 0x{:08X}".format(cpu_thread_id, msr_addr, eax, edx) )
+        return results
+
     def write_msr( self, cpu_thread_id, msr_addr, eax, edx ):
         self.helper.write_msr( cpu_thread_id, msr_addr, eax, edx )
         if logger().HAL: logger().log( "[cpu{:d}] WRMSR( 0x{:x} ): EAX = 0x{:08X}, EDX = 0x{:08X}".format(cpu_thread_id, msr_addr, eax, edx) )
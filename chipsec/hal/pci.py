@@ -298,6 +298,11 @@ class Pci:
         return devices
 
     def dump_pci_config( self, bus, device, function ):
+        cfg_buf = self.helper.read_pci_range( bus, device, function, 0, 0x100 )
+        if cfg_buf is not None:
+            if logger().HAL:
+                logger().log( "[pci] reading B/D/F: {:d}/{:d}/{:d}, offset: 0x00, size: 0x100".format(bus, device, function) )
+            return list(cfg_buf)
         cfg = []
         for off in range(0, 0x100, 4):
             tmp_val = self.read_dword(bus, device, function, off)
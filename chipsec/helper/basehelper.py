@@ -18,6 +18,24 @@
 #chipsec@intel.com
 #
 from chipsec.logger import logger
+from chipsec import defines
+
+def read_reg_range( read_reg, address, size ):
+    """Read size bytes starting at address with read_reg( address, width ) and return them as bytes.
+
+    Aligned DWORDs are read with one access each, any unaligned head or tail
+    byte by byte. Returns None if any access fails (read_reg returns None).
+    """
+    block = bytearray()
+    end = address + size
+    while address < end:
+        width = 4 if (end - address >= 4 and address % 4 == 0) else 1
+        value = read_reg( address, width )
+        if value is None:
+            return None
+        block += defines.pack1( value & ((1 << (width * 8)) - 1), width )
+        address += width
+    return bytes(block)
 
 # Base class for the helpers
 class Helper(object):
@@ -73,6 +91,9 @@ class Helper(object):
         """Read PCI configuration registers via legacy CF8/CFC ports"""
         raise NotImplementedError()
 
+    def read_pci_range( self, bus, device, function, address, size ):
+        return read_reg_range( lambda addr, width: self.read_pci_reg( bus, device, function, addr, width ), address, size )
+
 
     def write_pci_reg( self, bus, device, function, address, value, size ):
         """Write PCI configuration registers via legacy CF8/CFC ports"""
@@ -85,6 +106,9 @@ class Helper(object):
     def read_mmio_reg( self, phys_address, size ):
         raise NotImplementedError()
 
+    def read_mmio_range( self, phys_address, size ):
+        return read_reg_range( self.read_mmio_reg, phys_address, size )
+
     def write_mmio_reg( self, phys_address, size, value ):
         raise NotImplementedError()
 
@@ -133,6 +157,9 @@ class Helper(object):
     def read_msr( self, cpu_thread_id, msr_addr ):
         raise NotImplementedError()
 
+    def read_msr_batch( self, requests ):
+        return [self.read_msr( cpu_thread_id, msr_addr ) for (cpu_thread_id, msr_addr) in requests]
+
     def write_msr( self, cpu_thread_id, msr_addr, eax, edx ):
         raise NotImplementedError()
 
@@ -126,6 +126,10 @@ class FileHelper(Helper):
             logger().warn( "Config register address is not naturally aligned" )
         return self.filecmds.getElement("read_pci_reg", (bus, device, function, address, size))
 
+    def read_pci_range( self, bus, device, function, address, size ):
+        ret = self.filecmds.getElement("read_pci_range", (bus, device, function, address, size))
+        return None if ret is None else ret.encode("latin_1")
+
     def write_pci_reg( self, bus, device, function, address, value, size ):
         """Write PCI configuration registers via legacy CF8/CFC ports"""
         if ( 0 != (address & (size - 1)) ):
@@ -139,6 +143,10 @@ class FileHelper(Helper):
     def read_mmio_reg( self, phys_address, size ):
         return self.filecmds.getElement("read_mmio_reg", (phys_address, size))
 
+    def read_mmio_range( self, phys_address, size ):
+        ret = self.filecmds.getElement("read_mmio_range", (phys_address, size))
+        return None if ret is None else ret.encode("latin_1")
+
     def write_mmio_reg( self, phys_address, size, value ):
         return self.filecmds.getElement("write_mmio_reg", (phys_address, size, value))
 
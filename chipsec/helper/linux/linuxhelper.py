@@ -23,10 +23,12 @@ Linux helper
 """
 
 import array
+import collections
 import ctypes
 import errno
 import fcntl
 import fnmatch
+import functools
 import mmap
 import os
 import platform
@@ -39,7 +41,7 @@ import shutil
 from chipsec import defines
 from chipsec.helper.oshelper import get_tools_path
 from chipsec.exceptions import OsHelperError, UnimplementedAPIError, UnimplementedNativeAPIError
-from chipsec.helper.basehelper import Helper
+from chipsec.helper.basehelper import Helper, read_reg_range
 from chipsec.logger import logger
 import chipsec.file
 from chipsec.hal.uefi_common import EFI_VARIABLE_NON_VOLATILE, EFI_VARIABLE_BOOTSERVICE_ACCESS, EFI_VARIABLE_RUNTIME_ACCESS
@@ -77,12 +79,23 @@ TIANO = os.path.join(chipsec.file.get_main_dir(), chipsec.file.TOOLS_DIR, "compr
 EFI   = os.path.join(chipsec.file.get_main_dir(), chipsec.file.TOOLS_DIR, "compression", "bin", "TianoCompress")
 BROTLI = os.path.join(chipsec.file.get_main_dir(), chipsec.file.TOOLS_DIR, "compression", "bin", "Brotli")
 
+EFIVARS_MOUNT_POINT = b"/sys/firmware/efi/efivars"
+
+_libc = ctypes.CDLL(None, use_errno=True)
+
 _tools = {
   chipsec.defines.COMPRESSION_TYPE_TIANO: 'TianoCompress',
   chipsec.defines.COMPRESSION_TYPE_LZMA: 'LzmaCompress',
   chipsec.defines.COMPRESSION_TYPE_BROTLI: 'Brotli'
 }
 
+@functools.lru_cache(maxsize=1024)
+def _parse_guid(guid):
+    """Split a GUID string into the 11 integer fields expected by the EFI variable ioctls."""
+    return (int(guid[:8], 16), int(guid[9:13], 16), int(guid[14:18], 16),
+            int(guid[19:21], 16), int(guid[21:23], 16), int(guid[24:26], 16), int(guid[26:28], 16),
+            int(guid[28:30], 16), int(guid[30:32], 16), int(guid[32:34], 16), int(guid[34:], 16))
+
 class MemoryMapping(mmap.mmap):
     """Memory mapping based on Python's mmap.
 
@@ -102,6 +115,12 @@ class LinuxHelper(Helper):
     SUPPORT_KERNEL26_GET_PAGE_IS_RAM = False
     SUPPORT_KERNEL26_GET_PHYS_MEM_ACCESS_PROT = False
     DKMS_DIR = "/var/lib/dkms/"
+    # Kernel symbols looked up in /proc/kallsyms and passed to the driver
+    KALLSYMS_LOOKUP = (b"page_is_ram", b"phys_mem_access_prot")
+    # Maximum number of MMIO pages kept mapped by read_mmio_range
+    MMIO_MMAP_CACHE_SIZE = 16
+    # IOCTL_LOAD_UCODE_PATCH header: thread id, update size
+    UCODE_PATCH_HEADER = struct.Struct('=BH')
 
     decompression_oder_type1 = [chipsec.defines.COMPRESSION_TYPE_TIANO, chipsec.defines.COMPRESSION_TYPE_UEFI]
     decompression_oder_type2 = [chipsec.defines.COMPRESSION_TYPE_TIANO, chipsec.defines.COMPRESSION_TYPE_UEFI, chipsec.defines.COMPRESSION_TYPE_LZMA, chipsec.defines.COMPRESSION_TYPE_BROTLI]
@@ -115,10 +134,22 @@ class LinuxHelper(Helper):
         self.os_uname   = platform.uname()
         self.name       = "LinuxHelper"
         self.dev_fh = None
+        # Raw descriptor of dev_fh, used directly by ioctl/pread/pwrite/mmap
+        self.dev_fd = None
         self.dev_mem = None
         self.dev_port = None
         self.dev_msr = None
         self.module_loaded = False
+        self.kallsyms = None
+        # CPU the process was last pinned to by set_affinity
+        self._affinity = None
+        # Read-only mappings of MMIO pages through /dev/chipsec used by
+        # read_mmio_range, keyed by page base address in least recently used order
+        self._mmio_mmaps = collections.OrderedDict()
+        # Physical address width reported by CPUID 0x80000008, queried on first use
+        self._max_pa = None
+        # Set when a variable is written through the driver while efivarfs is mounted
+        self.efivars_needs_remount = False
 
         # A list of all the mappings allocated via map_io_space. When using
         # read/write MMIO, if the region is already mapped in the process's
@@ -131,11 +162,10 @@ class LinuxHelper(Helper):
 
     def get_dkms_module_location(self):
         version     = defines.get_version()
-        from os import listdir
-        from os.path import isdir, join
         p =  os.path.join( self.DKMS_DIR, self.MODULE_NAME, version, self.os_release)
-        os_machine_dir_name = [f for f in listdir( p ) if isdir(join(p, f))][0]
-        return os.path.join( self.DKMS_DIR, self.MODULE_NAME, version, self.os_release, os_machine_dir_name, "module", "chipsec.ko" )
+        with os.scandir( p ) as it:
+            os_machine_dir_name = next(e.name for e in it if e.is_dir())
+        return os.path.join( p, os_machine_dir_name, "module", "chipsec.ko" )
 
 
     # This function load CHIPSEC driver
@@ -178,7 +208,7 @@ class LinuxHelper(Helper):
                     if not os.path.exists(driver_path):
                         raise Exception("Cannot find chipsec.ko module")
         try:
-            subprocess.check_output( [ "insmod", driver_path, a1, a2 ] )
+            self.insmod(driver_path, [a for a in (a1, a2) if a])
             self.module_loaded = True
         except Exception as err:
             raise Exception("Could not start Linux Helper, are you running as Admin/root?\n\t{}".format(err))
@@ -192,9 +222,48 @@ class LinuxHelper(Helper):
             logger().log_error("Fail to load module: {}".format(driver_path))
         self.driverpath = driver_path
 
+    def insmod(self, driver_path, params):
+        """Load a kernel module with init_module(2).
+
+        .ko.xz images are decompressed in-process. Falls back to the insmod
+        tool if the image cannot be decompressed here, libc lacks init_module
+        or the call is refused with EPERM, EACCES or ENOSYS (e.g. policies
+        that only allow finit_module). Other failures raise OSError.
+        """
+        try:
+            init_module = _libc.init_module
+            if driver_path.endswith(".xz"):
+                import lzma
+                with lzma.open(driver_path) as f:
+                    image = f.read()
+            else:
+                with open(driver_path, "rb") as f:
+                    image = f.read()
+        except (AttributeError, ImportError):
+            subprocess.check_output(["insmod", driver_path] + params)
+            return
+        if init_module(image, ctypes.c_ulong(len(image)), " ".join(params).encode()) == 0:
+            return
+        err = ctypes.get_errno()
+        if err not in (errno.EPERM, errno.EACCES, errno.ENOSYS):
+            raise OSError(err, "init_module failed: {}".format(os.strerror(err)), driver_path)
+        if logger().DEBUG: logger().log("init_module failed ({}), retrying with insmod".format(os.strerror(err)))
+        subprocess.check_output(["insmod", driver_path] + params)
+
+    def rmmod(self, module_name):
+        """Unload a kernel module with delete_module(2), falling back to the rmmod tool."""
+        try:
+            delete_module = _libc.delete_module
+        except AttributeError:
+            subprocess.call(["rmmod", module_name])
+            return
+        if delete_module(module_name.encode(), os.O_NONBLOCK) != 0:
+            err = ctypes.get_errno()
+            logger().log_error("Failed to unload module {}: {}".format(module_name, os.strerror(err)))
+
     def unload_chipsec_module(self):
         if self.module_loaded:
-            subprocess.call(["rmmod", self.MODULE_NAME])
+            self.rmmod(self.MODULE_NAME)
             self.module_loaded = False
             if logger().DEBUG:
                 logger().log("Module for {} unloaded successfully".format(self.DEVICE_NAME))
@@ -227,12 +296,15 @@ class LinuxHelper(Helper):
     def init(self, start_driver):
         x64 = True if sys.maxsize > 2**32 else False
         self._pack = 'Q' if x64 else 'I'
+        # Precompiled layouts for the ioctl argument buffers, keyed by the number of fields
+        self._structs = {n: struct.Struct(str(n) + self._pack) for n in (1, 2, 3, 4, 5, 7, 11)}
 
         if start_driver:
             logger().log("****** Chipsec Linux Kernel module is licensed under GPL 2.0")
 
             try:
-                self.dev_fh = open(self.DEVICE_NAME, "rb+")
+                self.dev_fh = open(self.DEVICE_NAME, "rb+", buffering=0)
+                self.dev_fd = self.dev_fh.fileno()
                 self.driver_loaded = True
             except IOError as e:
                 raise OsHelperError("Unable to open chipsec device. Did you run as root/sudo and load the driver?\n {}".format(str(e)), e.errno)
@@ -310,9 +382,14 @@ class LinuxHelper(Helper):
                                 "{}".format(str(err)), err.errno)
 
     def close(self):
+        self.remount_efivars()
+        for view in self._mmio_mmaps.values():
+            self._unmap_mmio_page(view)
+        self._mmio_mmaps.clear()
         if self.dev_fh:
             self.dev_fh.close()
         self.dev_fh = None
+        self.dev_fd = None
         if self.dev_mem:
             os.close(self.dev_mem)
         self.dev_mem = None
@@ -333,10 +410,22 @@ class LinuxHelper(Helper):
         # default _IOC_TYPESHIFT is 8
         # nr will be 0
         # _IOC_SIZESHIFT is 16
-        return (3 << 30) | (ord(itype) << 8) | (struct.calcsize(self._pack) << 16)
+        return (3 << 30) | (ord(itype) << 8) | (self._structs[1].size << 16)
 
-    def ioctl(self, nr, args, *mutate_flag):
-        return fcntl.ioctl(self.dev_fh, self._ioctl_base + nr, args)
+    def ioctl(self, nr, buf):
+        return fcntl.ioctl(self.dev_fd, self._ioctl_base + nr, buf, True)
+
+    def _ioctl_words(self, nr, *args):
+        """Issue an ioctl whose argument is a buffer of native words.
+
+        Returns the words as updated in place by the driver. The buffer is
+        allocated per call so that concurrent callers never share it.
+        """
+        layout = self._structs[len(args)]
+        buf = bytearray(layout.size)
+        layout.pack_into(buf, 0, *args)
+        self.ioctl(nr, buf)
+        return layout.unpack_from(buf)
 
 ###############################################################################################
 # Actual API functions to access HW resources
@@ -366,19 +455,11 @@ class LinuxHelper(Helper):
     def map_io_space(self, base, size, cache_type):
         raise UnimplementedAPIError("map_io_space")
 
-    def __mem_block(self, sz, newval = None):
-        if newval is None:
-            return self.dev_fh.read(sz)
-        else:
-            self.dev_fh.write(newval)
-            self.dev_fh.flush()
-        return 1
-
     def write_phys_mem(self, phys_address_hi, phys_address_lo, length, newval):
         if newval is None: return None
         addr = (phys_address_hi << 32) | phys_address_lo
-        self.dev_fh.seek(addr)
-        return self.__mem_block(length, newval)
+        os.pwrite(self.dev_fd, newval, addr)
+        return 1
 
     def native_write_phys_mem(self, phys_address_hi, phys_address_lo, length, newval):
         if newval is None: return None
@@ -391,8 +472,7 @@ class LinuxHelper(Helper):
 
     def read_phys_mem(self, phys_address_hi, phys_address_lo, length):
         addr = (phys_address_hi << 32) | phys_address_lo
-        self.dev_fh.seek(addr)
-        return self.__mem_block(length)
+        return os.pread(self.dev_fd, length, addr)
 
     def native_read_phys_mem(self, phys_address_hi, phys_address_lo, length):
         if self.devmem_available():
@@ -403,18 +483,17 @@ class LinuxHelper(Helper):
     def va2pa( self, va ):
         error_code = 0
 
-        in_buf = struct.pack(self._pack, va)
         try:
-            out_buf = self.ioctl(IOCTL_VA2PA, in_buf)
-            pa = struct.unpack(self._pack, out_buf)[0]
+            pa = self._ioctl_words(IOCTL_VA2PA, va)[0]
         except IOError as err:
             if logger().DEBUG:
                 logger().log_error("[helper] Error in va2pa: getting PA for VA 0x{:016X} failed with IOError: {}".format(va, err.strerror))
             return (None, err.errno)
 
         #Check if PA > max physical address
-        max_pa = self.cpuid( 0x80000008, 0x0 )[0] & 0xFF
-        if pa > 1<<max_pa:
+        if self._max_pa is None:
+            self._max_pa = self.cpuid( 0x80000008, 0x0 )[0] & 0xFF
+        if pa > 1<<self._max_pa:
             if logger().DEBUG: logger().log_error("[helper] Error in va2pa: PA higher that max physical address: VA (0x{:016X}) -> PA (0x{:016X})".format(va, pa))
             error_code = 1
         return (pa, error_code)
@@ -422,15 +501,28 @@ class LinuxHelper(Helper):
 
     def read_pci_reg( self, bus, device, function, offset, size = 4 ):
         _PCI_DOM = 0 #Change PCI domain, if there is more than one.
-        d = struct.pack("5" +self._pack, ((_PCI_DOM << 16) | bus), ((device << 16) | function), offset, size, 0)
         try:
-            ret = self.ioctl(IOCTL_RDPCI, d)
+            x = self._ioctl_words(IOCTL_RDPCI, ((_PCI_DOM << 16) | bus), ((device << 16) | function), offset, size, 0)
         except IOError:
             if logger().DEBUG: logger().log_error("IOError\n")
             return None
-        x = struct.unpack("5" +self._pack, ret)
         return x[4]
 
+    def read_pci_range(self, bus, device, function, offset, size):
+        """Read a block of PCI configuration space and return it as bytes.
+
+        Aligned DWORDs are read with one IOCTL_RDPCI each; any unaligned head
+        or tail is read byte by byte. Returns None if any of the reads fails.
+        """
+        _PCI_DOM = 0 #Change PCI domain, if there is more than one.
+        bus_arg = (_PCI_DOM << 16) | bus
+        dev_arg = (device << 16) | function
+        try:
+            return read_reg_range(lambda addr, width: self._ioctl_words(IOCTL_RDPCI, bus_arg, dev_arg, addr, width, 0)[4], offset, size)
+        except IOError:
+            if logger().DEBUG: logger().log_error("IOError\n")
+            return None
+
     def native_read_pci_reg(self, bus, device, function, offset, size, domain=0):
         device_name = "{domain:04x}:{bus:02x}:{device:02x}.{function}".format(
                       domain=domain, bus=bus, device=device, function=function)
@@ -456,13 +548,11 @@ class LinuxHelper(Helper):
 
     def write_pci_reg( self, bus, device, function, offset, value, size = 4 ):
         _PCI_DOM = 0 #Change PCI domain, if there is more than one.
-        d = struct.pack("5" +self._pack, ((_PCI_DOM << 16) | bus), ((device << 16) | function), offset, size, value)
         try:
-            ret = self.ioctl(IOCTL_WRPCI, d)
+            x = self._ioctl_words(IOCTL_WRPCI, ((_PCI_DOM << 16) | bus), ((device << 16) | function), offset, size, value)
         except IOError:
             if logger().DEBUG: logger().log_error("IOError\n")
             return None
-        x = struct.unpack("5" +self._pack, ret)
         return x[4]
 
     def native_write_pci_reg(self, bus, device, function, offset, value, size=4, domain=0):
@@ -484,14 +574,12 @@ class LinuxHelper(Helper):
         config.close()
 
     def load_ucode_update( self, cpu_thread_id, ucode_update_buf):
-        cpu_ucode_thread_id = ctypes.c_int(cpu_thread_id)
-
-        in_buf = struct.pack('=BH', cpu_thread_id, len(ucode_update_buf)) + ucode_update_buf
-        in_buf_final = array.array("c", in_buf)
-        #print_buffer(in_buf)
-        out_length=0
+        header_size = self.UCODE_PATCH_HEADER.size
+        in_buf = bytearray(header_size + len(ucode_update_buf))
+        self.UCODE_PATCH_HEADER.pack_into(in_buf, 0, cpu_thread_id, len(ucode_update_buf))
+        in_buf[header_size:] = ucode_update_buf
         try:
-            out_buf = self.ioctl(IOCTL_LOAD_UCODE_PATCH, in_buf_final)
+            self.ioctl(IOCTL_LOAD_UCODE_PATCH, in_buf)
         except IOError:
             if logger().DEBUG: logger().log_error("IOError IOCTL Load Patch\n")
             return None
@@ -500,20 +588,8 @@ class LinuxHelper(Helper):
 
 
     def read_io_port(self, io_port, size):
-        in_buf = struct.pack( "3" +self._pack, io_port, size, 0 )
-        out_buf = self.ioctl(IOCTL_RDIO, in_buf)
-        try:
-            #print_buffer(out_buf)
-            if 1 == size:
-                value = struct.unpack("3" +self._pack, out_buf)[2] & 0xff
-            elif 2 == size:
-                value = struct.unpack("3" +self._pack, out_buf)[2] & 0xffff
-            else:
-                value = struct.unpack("3" +self._pack, out_buf)[2] & 0xffffffff
-        except:
-            if logger().DEBUG: logger().log_error( "DeviceIoControl did not return value of proper size {:x} (value = '{}')".format(size, out_buf) )
-
-        return value
+        value = self._ioctl_words(IOCTL_RDIO, io_port, size, 0)[2]
+        return value & ((1 << (size * 8)) - 1)
 
     def native_read_io_port(self, io_port, size):
         if self.devport_available():
@@ -529,8 +605,9 @@ class LinuxHelper(Helper):
 
 
     def write_io_port( self, io_port, value, size ):
-        in_buf = struct.pack( "3" +self._pack, io_port, size, value )
-        return self.ioctl(IOCTL_WRIO, in_buf)
+        buf = bytearray(self._structs[3].pack(io_port, size, value))
+        self.ioctl(IOCTL_WRIO, buf)
+        return bytes(buf)
 
     def native_write_io_port(self, io_port, newval, size):
         if self.devport_available():
@@ -545,23 +622,39 @@ class LinuxHelper(Helper):
     def read_cr(self, cpu_thread_id, cr_number):
         self.set_affinity(cpu_thread_id)
         cr = 0
-        in_buf = struct.pack( "3" +self._pack, cpu_thread_id, cr_number, cr)
-        unbuf = struct.unpack("3" +self._pack, self.ioctl(IOCTL_RDCR, in_buf))
+        unbuf = self._ioctl_words(IOCTL_RDCR, cpu_thread_id, cr_number, cr)
         return (unbuf[2])
 
     def write_cr(self, cpu_thread_id, cr_number, value):
         self.set_affinity(cpu_thread_id)
-        in_buf = struct.pack( "3" +self._pack, cpu_thread_id, cr_number, value )
-        self.ioctl(IOCTL_WRCR, in_buf)
+        self._ioctl_words(IOCTL_WRCR, cpu_thread_id, cr_number, value)
         return
 
+    # The driver performs MSR accesses on the requested CPU itself
+    # ({rd,wr}msr_on_cpu), so MSR accessors do not change the process affinity
+
     def read_msr(self, thread_id, msr_addr):
-        self.set_affinity(thread_id)
         edx = eax = 0
-        in_buf = struct.pack( "4" +self._pack, thread_id, msr_addr, edx, eax)
-        unbuf = struct.unpack("4" +self._pack, self.ioctl(IOCTL_RDMSR, in_buf))
+        unbuf = self._ioctl_words(IOCTL_RDMSR, thread_id, msr_addr, edx, eax)
         return (unbuf[3], unbuf[2])
 
+    def read_msr_batch(self, requests):
+        """Read a sequence of MSRs.
+
+        requests is an iterable of (thread_id, msr_addr) tuples. Returns a
+        list of (eax, edx) tuples in request order.
+        """
+        requests = list(requests)
+        # All requests are laid out in one contiguous array of IOCTL_RDMSR
+        # records (thread_id, msr_addr, edx, eax) which the driver fills in place
+        records = array.array(self._pack, bytes(self._structs[4].size * len(requests)))
+        records[0::4] = array.array(self._pack, [thread_id for thread_id, _ in requests])
+        records[1::4] = array.array(self._pack, [msr_addr for _, msr_addr in requests])
+        view = memoryview(records)
+        for i in range(0, len(records), 4):
+            self.ioctl(IOCTL_RDMSR, view[i:i + 4])
+        return list(zip(records[3::4], records[2::4]))
+
     def native_read_msr(self, thread_id, msr_addr):
         if self.devmsr_available():
             os.lseek(self.dev_msr[thread_id], msr_addr, os.SEEK_SET)
@@ -570,9 +663,7 @@ class LinuxHelper(Helper):
             return (unbuf[0], unbuf[1])
 
     def write_msr(self, thread_id, msr_addr, eax, edx):
-        self.set_affinity(thread_id)
-        in_buf = struct.pack( "4" +self._pack, thread_id, msr_addr, edx, eax )
-        self.ioctl(IOCTL_WRMSR, in_buf)
+        self._ioctl_words(IOCTL_WRMSR, thread_id, msr_addr, edx, eax)
         return
 
     def native_write_msr(self, thread_id, msr_addr, eax, edx):
@@ -585,18 +676,14 @@ class LinuxHelper(Helper):
 
     def get_descriptor_table(self, cpu_thread_id, desc_table_code  ):
         self.set_affinity(cpu_thread_id)
-        in_buf = struct.pack( "5" +self._pack, cpu_thread_id, desc_table_code, 0, 0, 0)
-        out_buf = self.ioctl(IOCTL_GET_CPU_DESCRIPTOR_TABLE, in_buf)
-        (limit, base_hi, base_lo, pa_hi, pa_lo) = struct.unpack( "5" +self._pack, out_buf )
+        (limit, base_hi, base_lo, pa_hi, pa_lo) = self._ioctl_words(IOCTL_GET_CPU_DESCRIPTOR_TABLE, cpu_thread_id, desc_table_code, 0, 0, 0)
         pa = (pa_hi << 32) + pa_lo
         base = (base_hi << 32) + base_lo
         return (limit, base, pa)
 
     def cpuid(self, eax, ecx):
         # add ecx
-        in_buf = struct.pack( "4" +self._pack, eax, 0, ecx, 0)
-        out_buf = self.ioctl(IOCTL_CPUID, in_buf)
-        return struct.unpack( "4" +self._pack, out_buf )
+        return self._ioctl_words(IOCTL_CPUID, eax, 0, ecx, 0)
 
     def native_cpuid(self, eax, ecx):
         import chipsec.helper.linux.cpuid as cpuid
@@ -604,20 +691,66 @@ class LinuxHelper(Helper):
         return _cpuid(eax, ecx)
 
     def alloc_phys_mem(self, num_bytes, max_addr):
-        in_buf = struct.pack( "2" +self._pack, num_bytes, max_addr)
-        out_buf = self.ioctl(IOCTL_ALLOC_PHYSMEM, in_buf)
-        return struct.unpack( "2" +self._pack, out_buf )
+        return self._ioctl_words(IOCTL_ALLOC_PHYSMEM, num_bytes, max_addr)
 
     def free_phys_mem(self, physmem):
-        in_buf = struct.pack( "1" +self._pack, physmem)
-        out_buf = self.ioctl(IOCTL_FREE_PHYSMEM, in_buf)
-        return struct.unpack( "1" +self._pack, out_buf)[0]
+        return self._ioctl_words(IOCTL_FREE_PHYSMEM, physmem)[0]
+
+    def mmio_page(self, page_base):
+        """Returns a read-only memoryview of the MMIO page mapped through /dev/chipsec.
+
+        The last MMIO_MMAP_CACHE_SIZE mappings are kept for reuse until close().
+        Returns None if the page cannot be mapped.
+        """
+        view = self._mmio_mmaps.get(page_base)
+        if view is not None:
+            self._mmio_mmaps.move_to_end(page_base)
+            return view
+        try:
+            mapping = mmap.mmap(self.dev_fd, mmap.PAGESIZE, mmap.MAP_SHARED, mmap.PROT_READ, offset=page_base)
+        except (OSError, ValueError, OverflowError) as err:
+            if logger().DEBUG: logger().log_error("[helper] Unable to map MMIO page 0x{:016X}: {}".format(page_base, err))
+            return None
+        view = memoryview(mapping)
+        self._mmio_mmaps[page_base] = view
+        if len(self._mmio_mmaps) > self.MMIO_MMAP_CACHE_SIZE:
+            self._unmap_mmio_page(self._mmio_mmaps.popitem(last=False)[1])
+        return view
+
+    def _unmap_mmio_page(self, view):
+        mapping = view.obj
+        view.release()
+        mapping.close()
 
     def read_mmio_reg(self, phys_address, size):
-        in_buf = struct.pack( "2" +self._pack, phys_address, size)
-        out_buf = self.ioctl(IOCTL_RDMMIO, in_buf)
-        reg = out_buf[:size]
-        return defines.unpack1(reg, size)
+        return self._ioctl_words(IOCTL_RDMMIO, phys_address, size)[0] & ((1 << (size * 8)) - 1)
+
+    def read_mmio_range(self, bar_base, size):
+        """Read size bytes of MMIO starting at bar_base and return them as bytes.
+
+        Pages that can be mapped through /dev/chipsec are read from the mapping,
+        DWORD by DWORD; other pages go through read_mmio_reg. Returns None if
+        the driver fails any of the reads.
+        """
+        block = bytearray()
+        addr = bar_base
+        end = bar_base + size
+        try:
+            while addr < end:
+                page_offset = addr % mmap.PAGESIZE
+                chunk = min(end - addr, mmap.PAGESIZE - page_offset)
+                page = self.mmio_page(addr - page_offset)
+                if page is None:
+                    block += read_reg_range(self.read_mmio_reg, addr, chunk)
+                else:
+                    page_base = addr - page_offset
+                    with page.cast('I') as page_dw:
+                        block += read_reg_range(lambda a, width: page_dw[(a - page_base) // 4] if 4 == width else page[a - page_base], addr, chunk)
+                addr += chunk
+        except IOError:
+            if logger().DEBUG: logger().log_error("IOError\n")
+            return None
+        return bytes(block)
 
     def native_read_mmio_reg(self, bar_base, bar_size, offset, size):
         if bar_size is None or bar_size < offset:
@@ -638,8 +771,7 @@ class LinuxHelper(Helper):
             return reg
 
     def write_mmio_reg(self, phys_address, size, value):
-        in_buf = struct.pack( "3" +self._pack, phys_address, size, value )
-        out_buf = self.ioctl(IOCTL_WRMMIO, in_buf)
+        self._ioctl_words(IOCTL_WRMMIO, phys_address, size, value)
 
     def native_write_mmio_reg(self, bar_base, bar_size, offset, size, value):
         if bar_size is None: bar_size = offset + size
@@ -675,22 +807,18 @@ class LinuxHelper(Helper):
     #
     def msgbus_send_read_message( self, mcr, mcrx ):
         mdr_out = 0
-        in_buf  = struct.pack( "5" +self._pack, MSGBUS_MDR_OUT_MASK, mcr, mcrx, 0, mdr_out )
-        out_buf = self.ioctl( IOCTL_MSGBUS_SEND_MESSAGE, in_buf )
-        mdr_out = struct.unpack( "5" +self._pack, out_buf )[4]
+        mdr_out = self._ioctl_words(IOCTL_MSGBUS_SEND_MESSAGE, MSGBUS_MDR_OUT_MASK, mcr, mcrx, 0, mdr_out)[4]
         return mdr_out
 
     def msgbus_send_write_message( self, mcr, mcrx, mdr ):
-        in_buf  = struct.pack( "5" +self._pack, MSGBUS_MDR_IN_MASK, mcr, mcrx, mdr, 0 )
-        out_buf = self.ioctl( IOCTL_MSGBUS_SEND_MESSAGE, in_buf )
+        self._ioctl_words(IOCTL_MSGBUS_SEND_MESSAGE, MSGBUS_MDR_IN_MASK, mcr, mcrx, mdr, 0)
         return
 
     def msgbus_send_message( self, mcr, mcrx, mdr=None ):
         mdr_out = 0
-        if mdr is None: in_buf = struct.pack( "5" +self._pack, MSGBUS_MDR_OUT_MASK, mcr, mcrx, 0, mdr_out )
-        else:           in_buf = struct.pack( "5" +self._pack, (MSGBUS_MDR_IN_MASK | MSGBUS_MDR_OUT_MASK), mcr, mcrx, mdr, mdr_out )
-        out_buf = self.ioctl( IOCTL_MSGBUS_SEND_MESSAGE, in_buf )
-        mdr_out = struct.unpack( "5" +self._pack, out_buf )[4]
+        if mdr is None: out_buf = self._ioctl_words(IOCTL_MSGBUS_SEND_MESSAGE, MSGBUS_MDR_OUT_MASK, mcr, mcrx, 0, mdr_out)
+        else:           out_buf = self._ioctl_words(IOCTL_MSGBUS_SEND_MESSAGE, (MSGBUS_MDR_IN_MASK | MSGBUS_MDR_OUT_MASK), mcr, mcrx, mdr, mdr_out)
+        mdr_out = out_buf[4]
         return mdr_out
 
     #
@@ -706,8 +834,11 @@ class LinuxHelper(Helper):
 
 
     def set_affinity(self, thread_id):
+        if thread_id == self._affinity:
+            return thread_id
         try:
             os.sched_setaffinity(os.getpid(), {thread_id})
+            self._affinity = thread_id
             return thread_id
         except Exception:
             return None
@@ -719,6 +850,16 @@ class LinuxHelper(Helper):
     def use_efivars(self):
         return os.path.exists("/sys/firmware/efi/efivars/")
 
+    def remount_efivars(self):
+        """Remount efivarfs if EFI variables were set through the driver since it was last read."""
+        if not self.efivars_needs_remount:
+            return
+        self.efivars_needs_remount = False
+        if _libc.umount2(EFIVARS_MOUNT_POINT, 0) != 0:
+            logger().log_error("Failed to unmount efivarfs: {}".format(os.strerror(ctypes.get_errno())))
+        elif _libc.mount(b"efivarfs", EFIVARS_MOUNT_POINT, b"efivarfs", 0, None) != 0:
+            logger().log_error("Failed to mount efivarfs after unmounting it: {}".format(os.strerror(ctypes.get_errno())))
+
     def EFI_supported( self):
         return os.path.exists("/sys/firmware/efi/vars/") or os.path.exists("/sys/firmware/efi/efivars/")
 
@@ -750,7 +891,10 @@ class LinuxHelper(Helper):
     # Invoked when use_native_api() is False
     #
 
-    def kern_get_EFI_variable_full(self, name, guid):
+    def kern_get_EFI_variable_full(self, name, guid, size_hint=0):
+        # size_hint: expected size of the variable data. When it is large enough
+        # the variable is fetched by the first IOCTL_GET_EFIVAR, otherwise the
+        # driver reports EFI_BUFFER_TOO_SMALL and the call is retried.
         status_dict = { 0: "EFI_SUCCESS", 1: "EFI_LOAD_ERROR", 2: "EFI_INVALID_PARAMETER", 3: "EFI_UNSUPPORTED", 4: "EFI_BAD_BUFFER_SIZE", 5: "EFI_BUFFER_TOO_SMALL", 6: "EFI_NOT_READY", 7: "EFI_DEVICE_ERROR", 8: "EFI_WRITE_PROTECTED", 9: "EFI_OUT_OF_RESOURCES", 14: "EFI_NOT_FOUND", 26: "EFI_SECURITY_VIOLATION" }
         off = 0
         data = ""
@@ -760,27 +904,17 @@ class LinuxHelper(Helper):
         base = 12
         namelen = len(name)
         header_size = 52
-        data_size = header_size + namelen
-        guid0 = int(guid[:8], 16)
-        guid1 = int(guid[9:13], 16)
-        guid2 = int(guid[14:18], 16)
-        guid3 = int(guid[19:21], 16)
-        guid4 = int(guid[21:23], 16)
-        guid5 = int(guid[24:26], 16)
-        guid6 = int(guid[26:28], 16)
-        guid7 = int(guid[28:30], 16)
-        guid8 = int(guid[30:32], 16)
-        guid9 = int(guid[32:34], 16)
-        guid10 = int(guid[34:], 16)
-
-        in_buf = struct.pack('13I' +str(namelen) +'s', data_size, guid0, guid1, guid2, guid3, guid4, guid5, guid6, guid7, guid8, guid9, guid10, namelen, name.encode())
+        data_size = header_size + namelen + size_hint
+        guid_fields = _parse_guid(guid)
+
+        in_buf = struct.pack('13I' +str(namelen +size_hint) +'s', data_size, *guid_fields, namelen, name.encode())
         buffer = array.array("B", in_buf)
         stat = self.ioctl(IOCTL_GET_EFIVAR, buffer)
         new_size, status = struct.unpack( "2I", buffer[:8])
 
         if (status == 0x5):
             data_size = new_size + header_size + namelen # size sent by driver + size of header (size + guid) + size of name
-            in_buf = struct.pack('13I' +str(namelen +new_size) +'s', data_size, guid0, guid1, guid2, guid3, guid4, guid5, guid6, guid7, guid8, guid9, guid10, namelen, name.encode())
+            in_buf = struct.pack('13I' +str(namelen +new_size) +'s', data_size, *guid_fields, namelen, name.encode())
             buffer = array.array("B", in_buf)
             try:
                 stat = self.ioctl(IOCTL_GET_EFIVAR, buffer)
@@ -809,6 +943,13 @@ class LinuxHelper(Helper):
         (off, buf, hdr, data, guid, attr) = self.kern_get_EFI_variable_full(name, guid)
         return data
 
+    def _efivar_size_hint(self, entry):
+        """Data size of an efivarfs entry, or 0 (unknown) if it cannot be stat'ed."""
+        try:
+            return max(entry.stat().st_size - 4, 0)
+        except OSError:
+            return 0
+
     def kern_list_EFI_variables(self):
         varlist = []
         off = 0
@@ -816,21 +957,25 @@ class LinuxHelper(Helper):
         attr = 0
         try:
             if os.path.isdir('/sys/firmware/efi/efivars'):
-                varlist = os.listdir('/sys/firmware/efi/efivars')
+                self.remount_efivars()
+                # efivarfs file size is the 4-byte attributes plus the variable data,
+                # which lets each variable be read with a single ioctl
+                with os.scandir('/sys/firmware/efi/efivars') as it:
+                    varlist = [(entry.name, self._efivar_size_hint(entry)) for entry in it]
             elif os.path.isdir('/sys/firmware/efi/vars'):
-                varlist = os.listdir('/sys/firmware/efi/vars')
+                varlist = [(v, 0) for v in os.listdir('/sys/firmware/efi/vars')]
             else:
                 return None
         except Exception:
             if logger().DEBUG: logger().log_error('Failed to read /sys/firmware/efi/[vars|efivars]. Folder does not exist')
             return None
         variables = dict()
-        for v in varlist:
+        for v, size_hint in varlist:
             name = v[:-37]
             guid = v[len(name) +1:]
             if name and name is not None:
                 variables[name] = []
-                var = self.kern_get_EFI_variable_full(name, guid)
+                var = self.kern_get_EFI_variable_full(name, guid, size_hint)
                 (off, buf, hdr, data, guid, attr) = var
                 variables[name].append(var)
         return variables
@@ -845,19 +990,9 @@ class LinuxHelper(Helper):
             datalen = 0
             value = struct.pack('B', 0x0)
         data_size = header_size + namelen + datalen
-        guid0 = int(guid[:8], 16)
-        guid1 = int(guid[9:13], 16)
-        guid2 = int(guid[14:18], 16)
-        guid3 = int(guid[19:21], 16)
-        guid4 = int(guid[21:23], 16)
-        guid5 = int(guid[24:26], 16)
-        guid6 = int(guid[26:28], 16)
-        guid7 = int(guid[28:30], 16)
-        guid8 = int(guid[30:32], 16)
-        guid9 = int(guid[32:34], 16)
-        guid10 = int(guid[34:], 16)
-
-        in_buf = struct.pack('15I' +str(namelen) +'s' +str(datalen) +'s', data_size, guid0, guid1, guid2, guid3, guid4, guid5, guid6, guid7, guid8, guid9, guid10, attr, namelen, datalen, name.encode('utf-8'), value)
+        guid_fields = _parse_guid(guid)
+
+        in_buf = struct.pack('15I' +str(namelen) +'s' +str(datalen) +'s', data_size, *guid_fields, attr, namelen, datalen, name.encode('utf-8'), value)
         buffer = array.array("B", in_buf)
         stat = self.ioctl(IOCTL_SET_EFIVAR, buffer)
         size, status = struct.unpack( "2I", buffer[:8])
@@ -865,8 +1000,10 @@ class LinuxHelper(Helper):
         if (status != 0):
             if logger().DEBUG:
                 logger().log_error("Setting EFI (SET_EFIVAR) variable did not succeed: '{}' ({:d})".format(status_dict.get(status, 'UNKNOWN'), status))
-        else:
-            os.system('umount /sys/firmware/efi/efivars; mount -t efivarfs efivarfs /sys/firmware/efi/efivars')
+        elif self.use_efivars():
+            # efivarfs does not see variables changed through runtime services
+            # until it is remounted; defer that until it is read again
+            self.efivars_needs_remount = True
         return status
 
     #
@@ -987,6 +1124,7 @@ class LinuxHelper(Helper):
 
     def EFIVARS_list_EFI_variables (self):
         varlist = []
+        self.remount_efivars()
         try:
             varlist = os.listdir('/sys/firmware/efi/efivars')
         except Exception:
@@ -1006,6 +1144,7 @@ class LinuxHelper(Helper):
 
     def EFIVARS_get_EFI_variable( self, name, guid ):
         filename = name + "-" + guid
+        self.remount_efivars()
         try:
             f = open('/sys/firmware/efi/efivars/' + filename, 'rb')
             data = f.read()
@@ -1027,6 +1166,7 @@ class LinuxHelper(Helper):
         if not guid: guid = '*'
 
         path = '/sys/firmware/efi/efivars/{}-{}'.format(name, guid)
+        self.remount_efivars()
         if value is not None:
             try:
                 if os.path.isfile(path):
@@ -1057,18 +1197,14 @@ class LinuxHelper(Helper):
     # Hypercalls
     #
     def hypercall( self, rcx, rdx, r8, r9, r10, r11, rax, rbx, rdi, rsi, xmm_buffer ):
-        in_buf  = struct.pack('<11' + self._pack, rcx, rdx, r8, r9, r10, r11, rax, rbx, rdi, rsi, xmm_buffer)
-        out_buf = self.ioctl(IOCTL_HYPERCALL, in_buf)
-        return struct.unpack('<11' + self._pack, out_buf)[0]
+        return self._ioctl_words(IOCTL_HYPERCALL, rcx, rdx, r8, r9, r10, r11, rax, rbx, rdi, rsi, xmm_buffer)[0]
 
     #
     # Interrupts
     #
     def send_sw_smi( self, cpu_thread_id, SMI_code_data, _rax, _rbx, _rcx, _rdx, _rsi, _rdi ):
         self.set_affinity(cpu_thread_id)
-        in_buf = struct.pack( "7" +self._pack, SMI_code_data, _rax, _rbx, _rcx, _rdx, _rsi, _rdi )
-        out_buf = self.ioctl(IOCTL_SWSMI, in_buf)
-        ret = struct.unpack("7" +self._pack, out_buf)
+        ret = self._ioctl_words(IOCTL_SWSMI, SMI_code_data, _rax, _rbx, _rcx, _rdx, _rsi, _rdi)
         return ret
 
 
@@ -1083,19 +1219,30 @@ class LinuxHelper(Helper):
     def getcwd( self ):
         return os.getcwd()
 
+    def get_kallsyms( self ):
+        """Returns a dict mapping the KALLSYMS_LOOKUP symbols found to their address strings.
+
+        /proc/kallsyms is scanned once, stopping as soon as all of them are found.
+        """
+        if self.kallsyms is None:
+            symbols = {}
+            with open("/proc/kallsyms", "rb") as f:
+                for line in f:
+                    fields = line.split()
+                    if len(fields) >= 3 and fields[2] in self.KALLSYMS_LOOKUP:
+                        symbols.setdefault(fields[2], fields[0])
+                        if len(symbols) == len(self.KALLSYMS_LOOKUP):
+                            break
+            self.kallsyms = symbols
+        return self.kallsyms
+
     def get_page_is_ram( self ):
-        PROC_KALLSYMS = "/proc/kallsyms"
-        symarr = chipsec.file.read_file(PROC_KALLSYMS).splitlines()
-        for line in symarr:
-            if "page_is_ram" in line:
-                return line.split(" ")[0]
+        addr = self.get_kallsyms().get(b"page_is_ram")
+        return addr.decode() if addr is not None else None
 
     def get_phys_mem_access_prot( self ):
-        PROC_KALLSYMS = "/proc/kallsyms"
-        symarr = chipsec.file.read_file(PROC_KALLSYMS).splitlines()
-        for line in symarr:
-            if "phys_mem_access_prot" in line:
-                return line.split(" ")[0]
+        addr = self.get_kallsyms().get(b"phys_mem_access_prot")
+        return addr.decode() if addr is not None else None
 
     def rotate_list(self, list, n):
         return list[n:] + list[:n]
@@ -31,6 +31,7 @@ import sys
 import chipsec.file
 from chipsec.logger import logger
 from chipsec.exceptions import UnimplementedAPIError, OsHelperError
+from chipsec.helper.basehelper import read_reg_range
 
 avail_helpers = []
 
@@ -160,6 +161,16 @@ class OsHelper:
             self.filecmds.AddElement("read_pci_reg", (bus, device, function, address, size), ret)
         return ret
 
+    def read_pci_range( self, bus, device, function, address, size ):
+        """Read size bytes of PCI configuration space, returning bytes or None on failure"""
+        if self.use_native_api() and hasattr(self.helper, 'native_read_pci_reg'):
+            ret = read_reg_range( lambda addr, width: self.helper.native_read_pci_reg( bus, device, function, addr, width ), address, size )
+        else:
+            ret = self.helper.read_pci_range( bus, device, function, address, size )
+        if not self.filecmds is None:
+            self.filecmds.AddElement("read_pci_range", (bus, device, function, address, size), ret)
+        return ret
+
     def write_pci_reg( self, bus, device, function, address, value, size ):
         """Write PCI configuration registers via legacy CF8/CFC ports"""
         if ( 0 != (address & (size - 1)) ):
@@ -185,6 +196,20 @@ class OsHelper:
             self.filecmds.AddElement("read_mmio_reg", (bar_base + offset, size), ret)
         return ret
 
+    def read_mmio_range( self, bar_base, size ):
+        """Read size bytes of MMIO starting at bar_base, returning bytes or None on failure"""
+        if self.use_native_api() and hasattr(self.helper, 'native_read_mmio_reg'):
+            # Native MMIO reads are DWORD-only, so unaligned ranges are left to the caller's per-register fallback
+            if (bar_base | size) & 0x3:
+                ret = None
+            else:
+                ret = read_reg_range( lambda addr, width: self.helper.native_read_mmio_reg( bar_base, size, addr - bar_base, width ), bar_base, size )
+        else:
+            ret = self.helper.read_mmio_range( bar_base, size )
+        if not self.filecmds is None:
+            self.filecmds.AddElement("read_mmio_range", (bar_base, size), ret)
+        return ret
+
     def write_mmio_reg( self, bar_base, size, value, offset=0, bar_size=None ):
         if self.use_native_api() and hasattr(self.helper, 'native_write_mmio_reg'):
             ret = self.helper.native_write_mmio_reg( bar_base, bar_size, offset, size, value )
@@ -309,6 +334,19 @@ class OsHelper:
             self.filecmds.AddElement("read_msr", (cpu_thread_id, msr_addr), ret)
         return ret
 
+    def read_msr_batch( self, requests ):
+        """Read a list of (cpu_thread_id, msr_addr) MSRs, returning (eax, edx) tuples in the same order"""
+        requests = list(requests)
+        if self.use_native_api() and hasattr(self.helper, 'native_read_msr'):
+            ret = [self.helper.native_read_msr( cpu_thread_id, msr_addr ) for (cpu_thread_id, msr_addr) in requests]
+        else:
+            ret = self.helper.read_msr_batch( requests )
+        if not self.filecmds is None:
+            # Recorded as individual reads so that a replay can serve them through read_msr
+            for (cpu_thread_id, msr_addr), value in zip(requests, ret):
+                self.filecmds.AddElement("read_msr", (cpu_thread_id, msr_addr), value)
+        return ret
+
     def write_msr( self, cpu_thread_id, msr_addr, eax, edx ):
         if self.use_native_api() and hasattr(self.helper, 'native_write_msr'):
             ret = self.helper.native_write_msr( cpu_thread_id, msr_addr, eax, edx )
@@ -0,0 +1,396 @@
+#CHIPSEC: Platform Security Assessment Framework
+#
+#This program is free software; you can redistribute it and/or
+#modify it under the terms of the GNU General Public License
+#as published by the Free Software Foundation; Version 2.
+#
+#This program is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU General Public License
+#along with this program; if not, write to the Free Software
+#Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+#
+import errno
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+if sys.platform.startswith('linux'):
+    from chipsec.helper.linux import linuxhelper
+
+
+@unittest.skipUnless(sys.platform.startswith('linux'), "requires the Linux helper")
+class TestLinuxHelper(unittest.TestCase):
+    """Test how the Linux helper talks to the chipsec driver.
+
+    The ioctl method is replaced by a stub emulating the driver and MMIO
+    mappings are backed by a temporary file, so no kernel module is needed.
+    """
+
+    def setUp(self):
+        self.helper = linuxhelper.LinuxHelper()
+        self.helper.init(False)
+        self.calls = []
+
+    def test_read_msr_batch(self):
+        def ioctl(nr, buf):
+            self.assertEqual(nr, linuxhelper.IOCTL_RDMSR)
+            # IOCTL_RDMSR record: thread_id, msr_addr, edx, eax
+            words = memoryview(buf).cast('B').cast(self.helper._pack)
+            self.calls.append((words[0], words[1]))
+            words[2] = 0xE000 + words[1]
+            words[3] = 0xA000 + words[0]
+        self.helper.ioctl = ioctl
+
+        results = self.helper.read_msr_batch([(0, 0x10), (1, 0x3A), (2, 0x1B)])
+        self.assertEqual(self.calls, [(0, 0x10), (1, 0x3A), (2, 0x1B)])
+        self.assertEqual(results, [(0xA000, 0xE010), (0xA001, 0xE03A), (0xA002, 0xE01B)])
+        self.assertEqual(results[1], self.helper.read_msr(1, 0x3A))
+
+    def _mmio_file(self, pages):
+        """Back the MMIO mappings with a temporary file of random contents."""
+        data = os.urandom(pages * mmap.PAGESIZE)
+        f = tempfile.TemporaryFile()
+        self.addCleanup(f.close)
+        f.write(data)
+        f.flush()
+        self.helper.dev_fd = f.fileno()
+        return data
+
+    def _rdmmio_ioctl(self, data):
+        layout = self.helper._structs[2]
+
+        def ioctl(nr, buf):
+            self.assertEqual(nr, linuxhelper.IOCTL_RDMMIO)
+            (addr, size) = layout.unpack_from(buf)
+            self.calls.append((addr, size))
+            layout.pack_into(buf, 0, int.from_bytes(data[addr:addr + size], 'little'), size)
+        return ioctl
+
+    def test_read_mmio_range_across_pages(self):
+        data = self._mmio_file(3)
+
+        self.assertEqual(self.helper.read_mmio_range(mmap.PAGESIZE - 8, mmap.PAGESIZE + 16), data[mmap.PAGESIZE - 8:2 * mmap.PAGESIZE + 8])
+        self.assertEqual(list(self.helper._mmio_mmaps), [0, mmap.PAGESIZE, 2 * mmap.PAGESIZE])
+
+    def test_read_mmio_range_unaligned_head_and_tail(self):
+        data = self._mmio_file(2)
+
+        self.assertEqual(self.helper.read_mmio_range(mmap.PAGESIZE - 3, 0xB), data[mmap.PAGESIZE - 3:mmap.PAGESIZE + 8])
+        self.assertEqual(self.helper.read_mmio_range(0x101, 0x2), data[0x101:0x103])
+
+    def test_read_mmio_range_evicts_least_recently_used(self):
+        data = self._mmio_file(4)
+        self.helper.MMIO_MMAP_CACHE_SIZE = 2
+
+        self.helper.read_mmio_range(0, 4)
+        first = self.helper._mmio_mmaps[0].obj
+        self.helper.read_mmio_range(mmap.PAGESIZE, 4)
+        self.helper.read_mmio_range(0, 4)
+        self.helper.read_mmio_range(2 * mmap.PAGESIZE, 4)
+        self.assertEqual(list(self.helper._mmio_mmaps), [0, 2 * mmap.PAGESIZE])
+        self.assertFalse(first.closed)
+
+        self.assertEqual(self.helper.read_mmio_range(3 * mmap.PAGESIZE, 8), data[3 * mmap.PAGESIZE:3 * mmap.PAGESIZE + 8])
+        self.assertEqual(list(self.helper._mmio_mmaps), [2 * mmap.PAGESIZE, 3 * mmap.PAGESIZE])
+        self.assertTrue(first.closed)
+
+    def test_read_mmio_range_falls_back_to_ioctl(self):
+        data = self._mmio_file(1)
+        self.helper.ioctl = self._rdmmio_ioctl(data)
+
+        with mock.patch.object(linuxhelper.mmap, 'mmap', side_effect=OSError()):
+            self.assertEqual(self.helper.read_mmio_range(0x102, 0xA), data[0x102:0x10C])
+        self.assertEqual(self.calls, [(0x102, 1), (0x103, 1), (0x104, 4), (0x108, 4)])
+        # A failed mapping is not remembered, the next read maps the page
+        self.assertEqual(len(self.helper._mmio_mmaps), 0)
+        self.assertEqual(self.helper.read_mmio_range(0x100, 4), data[0x100:0x104])
+        self.assertEqual(list(self.helper._mmio_mmaps), [0])
+
+    def test_close_releases_mmio_mappings(self):
+        self._mmio_file(3)
+        self.helper.read_mmio_range(0, 3 * mmap.PAGESIZE)
+        mappings = [view.obj for view in self.helper._mmio_mmaps.values()]
+        self.assertEqual(len(mappings), 3)
+
+        self.helper.close()
+        self.assertTrue(all(mapping.closed for mapping in mappings))
+        self.assertEqual(len(self.helper._mmio_mmaps), 0)
+
+    def _efivar_ioctl(self, data, attr):
+        def ioctl(nr, buf):
+            self.assertEqual(nr, linuxhelper.IOCTL_GET_EFIVAR)
+            (data_size, ) = struct.unpack_from("I", buf)
+            (namelen, ) = struct.unpack_from("I", buf, 48)
+            self.calls.append(data_size)
+            # The driver returns the variable in place of the request, after
+            # the size, status and attributes words
+            if data_size - 52 - namelen < len(data):
+                struct.pack_into("2I", buf, 0, len(data), 5)
+            else:
+                struct.pack_into("3I", buf, 0, len(data), 0, attr)
+                buf[12:12 + len(data)] = type(buf)("B", data)
+        return ioctl
+
+    def test_get_EFI_variable_size_hint(self):
+        data = b"\x01\x02\x03\x04\x05\x06"
+        self.helper.ioctl = self._efivar_ioctl(data, 0x7)
+
+        var = self.helper.kern_get_EFI_variable_full("Boot0000", "8BE4DF61-93CA-11D2-AA0D-00E098032B8C", len(data))
+        self.assertEqual(var[3], data)
+        self.assertEqual(var[5], 0x7)
+        self.assertEqual(self.calls, [52 + len("Boot0000") + len(data)])
+
+    def test_get_EFI_variable_without_size_hint(self):
+        data = b"\x01\x02\x03\x04\x05\x06"
+        self.helper.ioctl = self._efivar_ioctl(data, 0x7)
+
+        var = self.helper.kern_get_EFI_variable_full("Boot0000", "8BE4DF61-93CA-11D2-AA0D-00E098032B8C")
+        self.assertEqual(var[3], data)
+        self.assertEqual(var[5], 0x7)
+        self.assertEqual(self.calls, [52 + len("Boot0000"), 52 + len("Boot0000") + len(data)])
+
+
+    def test_efivar_size_hint(self):
+        class Entry(object):
+            def __init__(self, size):
+                self.size = size
+            def stat(self):
+                if self.size is None:
+                    raise OSError()
+                return os.stat_result((0, 0, 0, 0, 0, 0, self.size, 0, 0, 0))
+
+        self.assertEqual(self.helper._efivar_size_hint(Entry(10)), 6)
+        self.assertEqual(self.helper._efivar_size_hint(Entry(2)), 0)
+        self.assertEqual(self.helper._efivar_size_hint(Entry(None)), 0)
+
+    def test_parse_guid(self):
+        self.assertEqual(linuxhelper._parse_guid("8BE4DF61-93CA-11D2-AA0D-00E098032B8C"),
+                         (0x8BE4DF61, 0x93CA, 0x11D2, 0xAA, 0x0D, 0x00, 0xE0, 0x98, 0x03, 0x2B, 0x8C))
+
+    def _pci_ioctl(self, cfg):
+        layout = self.helper._structs[5]
+
+        def ioctl(nr, buf):
+            self.assertEqual(nr, linuxhelper.IOCTL_RDPCI)
+            (bus, devfn, offset, size, _) = layout.unpack_from(buf)
+            self.calls.append((offset, size))
+            value = int.from_bytes(cfg[offset:offset + size], 'little')
+            layout.pack_into(buf, 0, bus, devfn, offset, size, value)
+        return ioctl
+
+    def test_read_pci_range_unaligned_head_and_tail(self):
+        cfg = bytes(range(0x100))
+        self.helper.ioctl = self._pci_ioctl(cfg)
+
+        self.assertEqual(self.helper.read_pci_range(0, 0x1F, 3, 0x2, 0xB), cfg[0x2:0xD])
+        self.assertEqual(self.calls, [(0x2, 1), (0x3, 1), (0x4, 4), (0x8, 4), (0xC, 1)])
+
+    def test_read_pci_range_aligned(self):
+        cfg = bytes(range(0x100))
+        self.helper.ioctl = self._pci_ioctl(cfg)
+
+        self.assertEqual(self.helper.read_pci_range(0, 0, 0, 0x0, 0x100), cfg)
+        self.assertEqual(self.calls, [(offset, 4) for offset in range(0, 0x100, 4)])
+
+    def test_read_pci_range_error(self):
+        def ioctl(nr, buf):
+            raise IOError()
+        self.helper.ioctl = ioctl
+
+        self.assertIsNone(self.helper.read_pci_range(0, 0, 0, 0x0, 0x10))
+
+
+    def _efivarfs(self, set_status=0, efivars=True):
+        """Stub the driver's IOCTL_SET_EFIVAR, efivarfs presence and the libc mount calls."""
+        def ioctl(nr, buf):
+            self.assertEqual(nr, linuxhelper.IOCTL_SET_EFIVAR)
+            struct.pack_into("2I", buf, 0, 0, set_status)
+        self.helper.ioctl = ioctl
+        self.helper.use_efivars = lambda: efivars
+        libc = mock.Mock()
+        libc.umount2.return_value = 0
+        libc.mount.return_value = 0
+        patcher = mock.patch.object(linuxhelper, '_libc', libc)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return libc
+
+    def _set_variable(self):
+        return self.helper.kern_set_EFI_variable("Test", "8BE4DF61-93CA-11D2-AA0D-00E098032B8C", b"\x01")
+
+    def test_efivars_remount_coalesced(self):
+        libc = self._efivarfs()
+        remount = [mock.call.umount2(linuxhelper.EFIVARS_MOUNT_POINT, 0),
+                   mock.call.mount(b"efivarfs", linuxhelper.EFIVARS_MOUNT_POINT, b"efivarfs", 0, None)]
+
+        for _ in range(3):
+            self.assertEqual(self._set_variable(), 0)
+        self.assertEqual(libc.mock_calls, [])
+        self.helper.EFIVARS_list_EFI_variables()
+        self.assertEqual(libc.mock_calls, remount)
+        self.helper.EFIVARS_get_EFI_variable("Test", "8BE4DF61-93CA-11D2-AA0D-00E098032B8C")
+        self.assertEqual(libc.mock_calls, remount)
+
+        self._set_variable()
+        with mock.patch.object(linuxhelper.os.path, 'isdir', return_value=True), \
+             mock.patch.object(linuxhelper.os, 'scandir', side_effect=OSError()):
+            self.helper.kern_list_EFI_variables()
+        self.assertEqual(libc.mock_calls, remount * 2)
+
+        self._set_variable()
+        self._set_variable()
+        with mock.patch('builtins.open', side_effect=OSError()):
+            self.helper.EFIVARS_set_EFI_variable("Test", "8BE4DF61-93CA-11D2-AA0D-00E098032B8C", b"\x01")
+        self.assertEqual(libc.mock_calls, remount * 3)
+
+        self._set_variable()
+        self.helper.close()
+        self.helper.close()
+        self.assertEqual(libc.mock_calls, remount * 4)
+
+    def test_efivars_no_remount_after_failed_set(self):
+        libc = self._efivarfs(set_status=8)
+
+        self.assertEqual(self._set_variable(), 8)
+        self.helper.EFIVARS_list_EFI_variables()
+        self.helper.close()
+        self.assertEqual(libc.mock_calls, [])
+
+    def test_efivars_no_remount_without_efivarfs(self):
+        libc = self._efivarfs(efivars=False)
+
+        self.assertEqual(self._set_variable(), 0)
+        self.helper.close()
+        self.assertEqual(libc.mock_calls, [])
+
+    def test_efivars_umount_failure(self):
+        libc = self._efivarfs()
+        libc.umount2.return_value = -1
+
+        self._set_variable()
+        with mock.patch.object(linuxhelper.logger(), 'log_error') as log_error:
+            self.helper.close()
+        libc.umount2.assert_called_once_with(linuxhelper.EFIVARS_MOUNT_POINT, 0)
+        libc.mount.assert_not_called()
+        self.assertEqual(log_error.call_count, 1)
+        self.assertIn("unmount efivarfs", log_error.call_args[0][0])
+
+
+    def _module_image(self, suffix=".ko", image=b"\x7fELF chipsec module"):
+        """Write a kernel module image to a temporary file and return its path."""
+        fd, path = tempfile.mkstemp(suffix=suffix)
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        if suffix.endswith(".xz"):
+            import lzma
+            with lzma.open(path, "wb") as f:
+                f.write(image)
+        else:
+            with open(path, "wb") as f:
+                f.write(image)
+        return path
+
+    def _insmod(self, path, params, init_module_errno=None):
+        """Run insmod with init_module failing with init_module_errno (None for success)."""
+        libc = mock.Mock()
+        libc.init_module.return_value = 0 if init_module_errno is None else -1
+        with mock.patch.object(linuxhelper, '_libc', libc), \
+             mock.patch.object(linuxhelper.ctypes, 'get_errno', return_value=init_module_errno), \
+             mock.patch.object(linuxhelper.subprocess, 'check_output') as check_output:
+            self.helper.insmod(path, params)
+        return libc, check_output
+
+    def test_insmod_init_module(self):
+        image = b"\x7fELF chipsec module"
+        path = self._module_image(image=image)
+
+        libc, check_output = self._insmod(path, ["a1=0x1234", "a2=0x5678"])
+        (args, _) = libc.init_module.call_args
+        self.assertEqual(args[0], image)
+        self.assertEqual(args[1].value, len(image))
+        self.assertEqual(args[2], b"a1=0x1234 a2=0x5678")
+        check_output.assert_not_called()
+
+        libc, check_output = self._insmod(path, [])
+        self.assertEqual(libc.init_module.call_args[0][2], b"")
+
+    def test_insmod_decompresses_xz(self):
+        image = b"\x7fELF compressed chipsec module" * 16
+        path = self._module_image(".ko.xz", image)
+
+        libc, check_output = self._insmod(path, [])
+        self.assertEqual(libc.init_module.call_args[0][0], image)
+        check_output.assert_not_called()
+
+    def test_insmod_falls_back_to_tool(self):
+        path = self._module_image()
+        for err in (errno.EPERM, errno.EACCES, errno.ENOSYS):
+            libc, check_output = self._insmod(path, ["a1=0x1234"], err)
+            libc.init_module.assert_called_once()
+            check_output.assert_called_once_with(["insmod", path, "a1=0x1234"])
+
+    def test_insmod_without_init_module(self):
+        path = self._module_image()
+        with mock.patch.object(linuxhelper, '_libc', mock.Mock(spec=[])), \
+             mock.patch.object(linuxhelper.subprocess, 'check_output') as check_output:
+            self.helper.insmod(path, ["a2=0x5678"])
+        check_output.assert_called_once_with(["insmod", path, "a2=0x5678"])
+
+    def test_insmod_raises_on_other_errors(self):
+        path = self._module_image()
+        for err in (errno.EEXIST, errno.ENOEXEC):
+            with self.assertRaises(OSError) as cm:
+                self._insmod(path, [], err)
+            self.assertEqual(cm.exception.errno, err)
+
+    def test_load_chipsec_module_params(self):
+        self.helper.SUPPORT_KERNEL26_GET_PAGE_IS_RAM = True
+        self.helper.SUPPORT_KERNEL26_GET_PHYS_MEM_ACCESS_PROT = True
+        self.helper.insmod = lambda driver_path, params: self.calls.append(params)
+        symbols = [("ffffffff8136e000", None), (None, "ffffffff81353650"), ("ffffffff8136e000", "ffffffff81353650"), (None, None)]
+        with mock.patch.object(linuxhelper.os.path, 'exists', side_effect=lambda path: path != self.helper.DEVICE_NAME), \
+             mock.patch.object(linuxhelper.os, 'chown'), mock.patch.object(linuxhelper.os, 'chmod'), \
+             mock.patch.object(linuxhelper.logger(), 'log_error'):
+            for page_is_ram, phys_mem_access_prot in symbols:
+                self.helper.get_page_is_ram = lambda: page_is_ram
+                self.helper.get_phys_mem_access_prot = lambda: phys_mem_access_prot
+                self.helper.load_chipsec_module()
+        self.assertEqual(self.calls, [["a1=0xffffffff8136e000"], ["a2=0xffffffff81353650"],
+                                      ["a1=0xffffffff8136e000", "a2=0xffffffff81353650"], []])
+
+    def test_rmmod(self):
+        libc = mock.Mock()
+        libc.delete_module.return_value = 0
+        with mock.patch.object(linuxhelper, '_libc', libc), \
+             mock.patch.object(linuxhelper.logger(), 'log_error') as log_error:
+            self.helper.rmmod("chipsec")
+        libc.delete_module.assert_called_once_with(b"chipsec", os.O_NONBLOCK)
+        log_error.assert_not_called()
+
+    def test_rmmod_failure_logged(self):
+        libc = mock.Mock()
+        libc.delete_module.return_value = -1
+        with mock.patch.object(linuxhelper, '_libc', libc), \
+             mock.patch.object(linuxhelper.ctypes, 'get_errno', return_value=errno.EBUSY), \
+             mock.patch.object(linuxhelper.logger(), 'log_error') as log_error:
+            self.helper.rmmod("chipsec")
+        self.assertEqual(log_error.call_count, 1)
+        self.assertIn(os.strerror(errno.EBUSY), log_error.call_args[0][0])
+
+    def test_rmmod_without_delete_module(self):
+        with mock.patch.object(linuxhelper, '_libc', mock.Mock(spec=[])), \
+             mock.patch.object(linuxhelper.subprocess, 'call') as call:
+            self.helper.rmmod("chipsec")
+        call.assert_called_once_with(["rmmod", "chipsec"])
+
+if __name__ == '__main__':
+    unittest.main()